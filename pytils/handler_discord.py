@@ -1,7 +1,6 @@
 import logging
-from socket import gethostname
-import json
 import requests
+from pytils.structured import structured, static_fields, dumps
 
 
 class DiscordFormatter(logging.Formatter):
@@ -16,15 +15,17 @@ class DiscordFormatter(logging.Formatter):
         Overwritten to return a dictionary of the relevant LogRecord attributes instead of a string.
         KeyError is raised if an unknown attribute is provided in the fmt_dict.
         Build the discord component https://autocode.com/tools/discord/embed-builder/
+        Fields are taken from the structured form of the record, which is shared with other handlers.
         """
+        fields = structured(record)
         return {"embeds": [
                             {
                               "type": "rich",
-                              "description": record.msg,
-                              "color": self.colormap[record.levelname] if record.levelname in self.colormap else 0x181c20,
-                              "timestamp": self.formatTime(record),
+                              "description": fields["message"],
+                              "color": self.colormap.get(fields["level"], 0x181c20),
+                              "timestamp": fields["time"],
                               "footer": {
-                                "text": f"{record.levelname} in {record.module}"
+                                "text": f"{fields['level']} in {fields['module']}"
                               }
                             }]}
 
@@ -42,7 +43,7 @@ class DiscordFormatter(logging.Formatter):
         #     if not record.exc_text:
         #         message_dict["embeds"][0].update({"title": record.message,
         #                                           'description': self.formatException(record.exc_info)})
-        return json.dumps(message_dict, default=str)
+        return dumps(message_dict)
 
 
 
@@ -59,7 +60,7 @@ class DiscordHandler(logging.Handler):
             raise ValueError("webhook_url parameter must be given and can not be empty!")
 
         if agent is None or agent == "":
-            agent = gethostname()
+            agent = static_fields()["container.name"]
 
         self._url = webhook_url
         self._agent = agent
@@ -0,0 +1,221 @@
+"""File handler, which can be shared by several processes (gunicorn, multiprocessing workers).
+
+Records are buffered in memory and appended to the file by chunks under the inter-process lock.
+ERROR and higher records flush the buffer immediately. The file is rotated by the calendar period,
+rotated files are compressed on the background thread.
+"""
+import datetime
+import glob
+import gzip
+import logging
+import multiprocessing.util
+import os
+import queue
+import shutil
+import sys
+import traceback
+import weakref
+from threading import Thread, Event
+
+try:
+    import fcntl
+except ImportError:
+    # no inter-process lock on Windows, the handler is safe for one process only
+    fcntl = None
+
+ROTATION_FORMATS = {'H': '%Y-%m-%d_%H', 'D': '%Y-%m-%d'}
+COMPRESSED_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+# handlers, which are not closed yet. Weak: the hooks below must not keep them alive
+_open_handlers = weakref.WeakSet()
+
+
+def compress_file(path: str, method: str) -> str:
+    """compress the file near the original one and delete the original. Path of the compressed file is returned"""
+    target = path + COMPRESSED_SUFFIXES[method]
+    with open(path, 'rb') as src, open(target + '.tmp', 'wb') as raw:
+        if method == 'zstd':
+            import zstandard
+            with zstandard.ZstdCompressor().stream_writer(raw) as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as dst:
+                shutil.copyfileobj(src, dst)
+    os.replace(target + '.tmp', target)
+    os.remove(path)
+    return target
+
+
+class SharedFileHandler(logging.Handler):
+
+    def __init__(self,
+                 filename: str,
+                 when: str = 'D',
+                 backup_count: int = 14,
+                 buffer_size: int = 64 * 1024,
+                 flush_level=logging.ERROR,
+                 flush_interval: float = 1,
+                 compression: str = 'gzip',
+                 level=logging.NOTSET):
+        super().__init__(level)
+        if when not in ROTATION_FORMATS:
+            raise ValueError('when has to be one of {}, not {}'.format(list(ROTATION_FORMATS), when))
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                compression = 'gzip'
+        if compression is not None and compression not in COMPRESSED_SUFFIXES:
+            raise ValueError('compression has to be one of {}, not {}'.format(list(COMPRESSED_SUFFIXES), compression))
+
+        self.baseFilename = os.path.abspath(filename)
+        self._period_format = ROTATION_FORMATS[when]
+        self._backup_count = backup_count
+        self._buffer_size = buffer_size
+        self._flush_level = logging._checkLevel(flush_level)
+        self._flush_interval = flush_interval
+        self._compression = compression
+        self._start()
+        _open_handlers.add(self)
+
+    def _start(self):
+        """buffers, file and threads of this process. Called again in the forked child"""
+        self._buffer = []
+        self._buffered = 0
+        self._stream = None
+        self._stop_event = Event()
+        self._compress_queue = queue.Queue()
+        self._flush_thread = Thread(target=self._flush_manager, daemon=True)
+        self._flush_thread.start()
+        self._compress_thread = Thread(target=self._compress_manager, daemon=True)
+        self._compress_thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = (self.format(record) + '\n').encode('utf-8')
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            full = self._buffered >= self._buffer_size
+        if full or record.levelno >= self._flush_level:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self._buffer:
+                return
+            data, self._buffer, self._buffered = b''.join(self._buffer), [], 0
+            try:
+                with open(self.baseFilename + '.lock', 'a') as lock_file:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    self._rollover_if_needed()
+                    self._open()
+                    # one write of the whole chunk, the file is opened in the append mode
+                    self._stream.write(data)
+                    self._stream.flush()
+            except Exception:
+                self._report_error()
+
+    def close(self) -> None:
+        _open_handlers.discard(self)
+        self._stop_event.set()
+        self.flush()
+        with self.lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+        self._compress_queue.put(None)
+        self._compress_thread.join(timeout=10)
+        super().close()
+
+    def _open(self) -> None:
+        """(re)open the file, if another process has rotated it"""
+        if self._stream is not None:
+            try:
+                if os.stat(self.baseFilename).st_ino == os.fstat(self._stream.fileno()).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            self._stream.close()
+        self._stream = open(self.baseFilename, 'ab')
+
+    def _rollover_if_needed(self) -> None:
+        """Rename the file, if it was written in the previous period. Called under the inter-process lock.
+        The period is taken from the file itself, so all processes agree, what to rotate."""
+        try:
+            mtime = datetime.datetime.fromtimestamp(os.path.getmtime(self.baseFilename))
+        except FileNotFoundError:
+            return
+        period = mtime.strftime(self._period_format)
+        if period == datetime.datetime.now().strftime(self._period_format):
+            return
+
+        rotated = '{}.{}'.format(self.baseFilename, period)
+        counter = 0
+        while glob.glob(glob.escape(rotated) + '*'):
+            counter += 1
+            rotated = '{}.{}.{}'.format(self.baseFilename, period, counter)
+        os.rename(self.baseFilename, rotated)
+        if self._compression is not None:
+            self._compress_queue.put(rotated)
+        self._remove_old_backups()
+
+    def _remove_old_backups(self) -> None:
+        # rotated names start with the date: "log.jsonl" is not a backup of "log"
+        backups = sorted(f for f in glob.glob(glob.escape(self.baseFilename) + '.[0-9]*')
+                         if not f.endswith('.tmp'))
+        if self._backup_count > 0:
+            for f in backups[:-self._backup_count]:
+                try:
+                    os.remove(f)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _report_error():
+        """the same as handleError, but there is no record for the buffered chunk"""
+        if logging.raiseExceptions and sys.stderr:
+            traceback.print_exc(file=sys.stderr)
+
+    def _flush_manager(self):
+        while not self._stop_event.wait(self._flush_interval):
+            self.flush()
+
+    def _compress_manager(self):
+        while True:
+            path = self._compress_queue.get()
+            if path is None:
+                return
+            try:
+                compress_file(path, self._compression)
+            except FileNotFoundError:
+                # already removed as the old backup
+                pass
+            except Exception:
+                self._report_error()
+
+
+def _restart_open_handlers():
+    """new buffers and threads for the handlers in the forked child"""
+    for handler in list(_open_handlers):
+        handler._start()
+
+
+def _flush_open_handlers():
+    for handler in list(_open_handlers):
+        handler.flush()
+
+
+def _flush_at_worker_exit(func):
+    """multiprocessing workers exit by os._exit without logging.shutdown, so the buffers are flushed by its finalizer"""
+    multiprocessing.util.Finalize(None, func, exitpriority=10)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_open_handlers)
+# called in every multiprocessing child after its finalizers are cleared
+multiprocessing.util.register_after_fork(_flush_open_handlers, _flush_at_worker_exit)
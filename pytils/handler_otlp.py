@@ -0,0 +1,252 @@
+"""One OTLP log pipeline for the whole process.
+
+All loggers share the provider, the exporter and the export thread for the same endpoint.
+Batches, which the collector didn't accept, are saved to the disk spool and sent again in the same order,
+when the collector is back.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import requests
+from opentelemetry.sdk._logs import LoggerProvider
+from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.exporter.otlp.proto.http._log_exporter import OTLPLogExporter
+from opentelemetry.exporter.otlp.proto.common._log_encoder import encode_logs
+
+try:
+    from opentelemetry.sdk._logs.export import LogRecordExporter as LogExporter
+    from opentelemetry.sdk._logs.export import LogRecordExportResult as LogExportResult
+except ImportError:
+    # older opentelemetry-sdk
+    from opentelemetry.sdk._logs.export import LogExporter, LogExportResult
+
+try:
+    import fcntl
+except ImportError:
+    # no inter-process lock on Windows, the spool is safe for one process only
+    fcntl = None
+
+from pytils.configurator import config_var_with_default
+from pytils.singleton import Singleton_args
+from pytils.structured import static_fields
+
+# this module can't log to the pipeline it serves, so messages go to the root logger only
+_logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.pb'
+# exporters of this process. Weak: the fork hook below must not keep them alive
+_exporters = weakref.WeakSet()
+# statuses of the batch, which the collector will never accept. Others (401, 403, 5xx...) are retried
+REJECTED_STATUSES = (400, 413)
+
+
+class DiskSpool:
+    """Bounded folder of serialized OTLP export requests. One file is one batch.
+    File names are sorted in the order of writing. The oldest batches are dropped, when the folder is full.
+    The folder can be shared by several processes: changes are made under the inter-process lock
+    and only one process replays the batches at a time.
+    """
+
+    def __init__(self, folder: str, max_bytes: int):
+        self._folder = folder
+        self._max_bytes = max_bytes
+        self._counter = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    @contextmanager
+    def _locked(self, name: str, blocking: bool = True):
+        """inter-process lock of the folder. Yields False, if it is taken by another process and not blocking"""
+        with open(os.path.join(self._folder, name), 'a') as lock_file:
+            if fcntl is None:
+                yield True
+                return
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def replaying(self):
+        """lock of the replay. Other processes skip the replay, while it is taken"""
+        return self._locked('replay.lock', blocking=False)
+
+    def segments(self) -> list:
+        """paths of the saved batches, the oldest first"""
+        return sorted(glob.glob(os.path.join(self._folder, '*' + SEGMENT_SUFFIX)))
+
+    def __len__(self):
+        return len(self.segments())
+
+    def push(self, data: bytes) -> None:
+        """save the batch as the newest segment"""
+        self._counter += 1
+        name = os.path.join(self._folder, '{:020d}-{}-{:06d}{}'.format(time.time_ns(), os.getpid(),
+                                                                       self._counter, SEGMENT_SUFFIX))
+        with self._locked('spool.lock'):
+            # write to the temporary file first: the half-written segment must not be sent
+            with open(name + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(name + '.tmp', name)
+
+            # the size is taken from the disk, other processes write to the same folder
+            sizes = []
+            for segment in self.segments():
+                try:
+                    sizes.append((segment, os.path.getsize(segment)))
+                except FileNotFoundError:
+                    pass
+            size = sum(s for _, s in sizes)
+            dropped = 0
+            for segment, segment_size in sizes:
+                if size <= self._max_bytes:
+                    break
+                self.remove(segment)
+                size -= segment_size
+                dropped += 1
+        if dropped:
+            _logger.warning('OTLP spool {} is full, {} oldest batches dropped'.format(self._folder, dropped))
+
+    def remove(self, segment: str) -> None:
+        try:
+            os.remove(segment)
+        except FileNotFoundError:
+            pass
+
+
+class SpoolingLogExporter(LogExporter):
+    """OTLP/HTTP exporter, which saves the failed batches to the DiskSpool.
+    While there is something in the spool, new batches are queued after it, so the collector gets the logs in order.
+    After a failed send the batches go straight to the spool, and the replay is tried again after the backoff,
+    which grows twice with every failure up to max_backoff seconds.
+    """
+
+    def __init__(self, endpoint: str, spool_folder: str, spool_max_bytes: int, timeout: float = 10,
+                 backoff: float = 1, max_backoff: float = 60):
+        self._endpoint = endpoint
+        self._timeout = timeout
+        self._exporter = OTLPLogExporter(endpoint=endpoint, timeout=timeout)
+        self._spool = DiskSpool(spool_folder, spool_max_bytes)
+        self._lock = threading.Lock()
+        self._min_backoff = backoff
+        self._max_backoff = max_backoff
+        self._backoff = backoff
+        self._retry_at = 0.
+        _exporters.add(self)
+
+    def export(self, batch):
+        with self._lock:
+            if not len(self._spool) and time.monotonic() >= self._retry_at:
+                if self._exporter.export(batch) == LogExportResult.SUCCESS:
+                    return LogExportResult.SUCCESS
+                self._failed()
+            try:
+                self._spool.push(encode_logs(batch).SerializeToString())
+            except Exception as ex:
+                _logger.error('OTLP batch of {} records is lost: {}'.format(len(batch), ex))
+                return LogExportResult.FAILURE
+            self._replay_if_due()
+            return LogExportResult.SUCCESS
+
+    def replay(self) -> bool:
+        """send the saved batches, if the backoff is over. True if the spool is empty now"""
+        with self._lock:
+            return self._replay_if_due()
+
+    def _failed(self) -> None:
+        """wait longer before the next try"""
+        self._retry_at = time.monotonic() + self._backoff
+        self._backoff = min(self._backoff * 2, self._max_backoff)
+
+    def _replay_if_due(self) -> bool:
+        if time.monotonic() < self._retry_at:
+            return False
+        with self._spool.replaying() as acquired:
+            if not acquired:
+                # another process sends them
+                return False
+            if self._replay():
+                self._backoff = self._min_backoff
+                return True
+            self._failed()
+            return False
+
+    def _replay(self) -> bool:
+        for segment in self._spool.segments():
+            try:
+                with open(segment, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # dropped by the full spool in the meantime
+                continue
+            success, status_code = self._send(data)
+            if success:
+                self._spool.remove(segment)
+            elif status_code in REJECTED_STATUSES:
+                _logger.error('OTLP collector rejected the saved batch {}: {}'.format(segment, status_code))
+                self._spool.remove(segment)
+            else:
+                return False
+        return True
+
+    def _send(self, data: bytes) -> tuple:
+        """Send the serialized batch the same way as the exporter: with its headers, compression and TLS
+        from the OTEL_EXPORTER_OTLP_* settings. (success, HTTP status or None) is returned."""
+        client = getattr(self._exporter, '_client', None)
+        if client is not None:
+            result = client.export(data)
+            return result.success, result.status_code
+        # older opentelemetry-exporter-otlp-proto-http
+        try:
+            response = self._exporter._export(data)
+        except (OSError, requests.exceptions.RequestException):
+            return False, None
+        return response.ok, response.status_code
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.replay()
+
+    def shutdown(self):
+        self._exporter.shutdown()
+
+
+def _reset_exporters_after_fork():
+    """the fork may happen during the export, while the lock is taken by the export thread, which is not copied"""
+    for exporter in list(_exporters):
+        exporter._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_exporters_after_fork)
+
+
+@Singleton_args
+def otlp_provider(endpoint: str) -> LoggerProvider:
+    """The one LoggerProvider with the batch processor and the spooling exporter for the endpoint.
+    Batch size, flush interval (seconds), queue size and spool limits are taken from the settings."""
+    spool_folder = config_var_with_default("LOG_OTLP_SPOOL_FOLDER",
+                                           config_var_with_default("LOG_FOLDER", './Assets/logs/') + 'otlp_spool/')
+    exporter = SpoolingLogExporter(endpoint,
+                                   spool_folder=spool_folder,
+                                   spool_max_bytes=config_var_with_default("LOG_OTLP_SPOOL_SIZE_MB", 64) * 2 ** 20,
+                                   timeout=config_var_with_default("LOG_OTLP_TIMEOUT", 10),
+                                   max_backoff=config_var_with_default("LOG_OTLP_MAX_BACKOFF", 60))
+    processor = BatchLogRecordProcessor(
+        exporter,
+        schedule_delay_millis=config_var_with_default("LOG_OTLP_FLUSH_INTERVAL", 5) * 1000,
+        max_export_batch_size=config_var_with_default("LOG_OTLP_BATCH_SIZE", 512),
+        max_queue_size=config_var_with_default("LOG_OTLP_QUEUE_SIZE", 2048))
+
+    provider = LoggerProvider(resource=Resource(attributes=static_fields()))
+    provider.add_log_record_processor(processor)
+    return provider
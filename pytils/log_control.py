@@ -0,0 +1,263 @@
+"""Change the levels of the logger sinks and sample noisy records while the program works.
+
+Sinks are the handlers of create_logger, named 'file', 'json', 'discord', 'telegram', 'otlp' and 'stream'.
+Levels can be changed by:
+* Python API: set_level('file', 'DEBUG'), restore_levels()
+* watched JSON file (LOG_CONTROL_FILE in settings):
+    {"levels": {"file": "DEBUG"},
+     "sampling": {"rate": 10, "burst": 20, "max_level": "DEBUG"},
+     "loggers": {"pyapp": {"levels": {"otlp": "INFO"}}}}
+* signals (LOG_CONTROL_SIGNALS = true): SIGUSR1 switches the local sinks (not discord and telegram) to DEBUG
+  and back, SIGUSR2 rereads the file.
+
+Sampler limits low level records per call site by probability or by token bucket (records per second).
+Number of the dropped records is added to the next passed record from the same place as `sampled_out`.
+"""
+import json
+import logging
+import os
+import random
+import signal
+import threading
+import time
+
+from pytils.configurator import config_var_with_default
+
+SINKS = ('file', 'json', 'discord', 'telegram', 'otlp', 'stream')
+# sinks without the blocking request per record. Only they are switched to DEBUG by toggle_debug
+LOCAL_SINKS = ('file', 'json', 'otlp', 'stream')
+
+# messages of this module go to the root logger, the pytils loggers are the object of the control
+_logger = logging.getLogger(__name__)
+
+_loggers = {}
+_initial_levels = {}
+# watched control file -> event, which stops its watcher
+_control_files = {}
+_debug_mode = False
+
+
+class Sampler(logging.Filter):
+    """Filter of the records not higher than max_level.
+    probability - part of the records to pass; rate - records per second to pass with the burst of the records.
+    Both work for every call site (file and line, or the function of @log) separately, if per_call_site,
+    otherwise for the whole logger.
+    """
+
+    def __init__(self, probability: float = None, rate: float = None, burst: int = 1,
+                 max_level='DEBUG', per_call_site: bool = True):
+        super().__init__()
+        if probability is None and rate is None:
+            raise ValueError('probability or rate has to be set for Sampler')
+        self.probability = probability
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_level = logging._checkLevel(max_level)
+        self.per_call_site = per_call_site
+        self._buckets = {}
+        self._dropped = {}
+        self._dropped_total = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        if self.per_call_site:
+            # @log wrappers log from one line for all functions, they give the decorated function instead
+            key = record.__dict__.get('call_site') or (record.pathname, record.lineno)
+        else:
+            key = None
+        with self._lock:
+            passed = self._take(key)
+            if not passed:
+                self._dropped[key] = self._dropped.get(key, 0) + 1
+                self._dropped_total[key] = self._dropped_total.get(key, 0) + 1
+                return False
+            dropped = self._dropped.pop(key, 0)
+        if dropped:
+            record.sampled_out = dropped
+        return True
+
+    def _take(self, key) -> bool:
+        if self.probability is not None and random.random() >= self.probability:
+            return False
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return False
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def stats(self) -> dict:
+        """number of the dropped records for every call site ('pathname:lineno', decorated function or '*')
+        since the start"""
+        with self._lock:
+            return {(key if isinstance(key, str) else '{}:{}'.format(*key) if key else '*'): count
+                    for key, count in self._dropped_total.items()}
+
+
+def register(logger: logging.Logger) -> None:
+    """Remember the logger and the levels of its sinks. Called by create_logger."""
+    _loggers[logger.name] = logger
+    for handler in logger.handlers:
+        if handler.name in SINKS:
+            _initial_levels.setdefault(handler, handler.level)
+
+    probability = config_var_with_default("LOG_SAMPLING_PROBABILITY", None)
+    rate = config_var_with_default("LOG_SAMPLING_RATE", None)
+    if probability is not None or rate is not None:
+        set_sampling(logger.name, probability=probability, rate=rate,
+                     burst=config_var_with_default("LOG_SAMPLING_BURST", 10),
+                     max_level=config_var_with_default("LOG_SAMPLING_MAX_LEVEL", 'DEBUG'))
+
+
+def _selected(logger_name=None) -> list:
+    if logger_name is None:
+        return list(_loggers.values())
+    if logger_name not in _loggers:
+        raise KeyError('Logger {} is not created by create_logger'.format(logger_name))
+    return [_loggers[logger_name]]
+
+
+def _sync_logger_level(logger: logging.Logger) -> None:
+    """the logger itself must pass everything, what the sinks want"""
+    levels = [h.level for h in logger.handlers]
+    if levels:
+        logger.setLevel(max(min(levels), 1))
+
+
+def set_level(sink: str, level, logger_name: str = None) -> None:
+    """Change the level of the sink for the logger (all pytils loggers by default). level None switches the sink off."""
+    if sink not in SINKS:
+        raise ValueError('sink has to be one of {}, not {}'.format(SINKS, sink))
+    level = logging.CRITICAL + 1 if level is None else logging._checkLevel(level)
+    for logger in _selected(logger_name):
+        for handler in logger.handlers:
+            if handler.name == sink:
+                handler.setLevel(level)
+        _sync_logger_level(logger)
+
+
+def get_levels(logger_name: str) -> dict:
+    """current level names of the logger sinks"""
+    [logger] = _selected(logger_name)
+    return {h.name: logging.getLevelName(h.level) for h in logger.handlers if h.name in SINKS}
+
+
+def restore_levels(logger_name: str = None) -> None:
+    """return the sinks to the levels from the settings"""
+    for logger in _selected(logger_name):
+        for handler in logger.handlers:
+            if handler in _initial_levels:
+                handler.setLevel(_initial_levels[handler])
+        _sync_logger_level(logger)
+
+
+def set_sampling(logger_name: str = None, probability: float = None, rate: float = None, burst: int = 1,
+                 max_level='DEBUG', per_call_site: bool = True) -> None:
+    """Put the Sampler to the logger (all pytils loggers by default) instead of the previous one.
+    Without probability and rate the sampling is switched off."""
+    for logger in _selected(logger_name):
+        for old in [f for f in logger.filters if isinstance(f, Sampler)]:
+            logger.removeFilter(old)
+        if probability is not None or rate is not None:
+            logger.addFilter(Sampler(probability=probability, rate=rate, burst=burst,
+                                     max_level=max_level, per_call_site=per_call_site))
+
+
+def sampling_stats(logger_name: str = None) -> dict:
+    """logger name -> dropped records per call site"""
+    return {logger.name: f.stats()
+            for logger in _selected(logger_name) for f in logger.filters if isinstance(f, Sampler)}
+
+
+def apply_settings(settings: dict) -> None:
+    """Apply the dict of the control file. See the module description for the format."""
+
+    def apply(section, logger_name):
+        for sink, level in section.get('levels', {}).items():
+            set_level(sink, level, logger_name)
+        if 'sampling' in section:
+            set_sampling(logger_name, **(section['sampling'] or {}))
+
+    apply(settings, None)
+    for logger_name, section in settings.get('loggers', {}).items():
+        apply(section, logger_name)
+
+
+def load_file(path: str) -> None:
+    with open(path) as f:
+        apply_settings(json.load(f))
+
+
+def watch_file(path: str, interval: float = 5, stop_event: threading.Event = None) -> threading.Event:
+    """Apply the control file now and every time it is changed. The file may appear later.
+    The watcher works until the returned event (or the given stop_event) is set, see stop_watching."""
+    stop_event = stop_event or threading.Event()
+    _control_files[path] = stop_event
+
+    def watcher():
+        last_mtime = None
+        while not stop_event.is_set():
+            try:
+                mtime = os.path.getmtime(path)
+                if mtime != last_mtime:
+                    last_mtime = mtime
+                    load_file(path)
+            except FileNotFoundError:
+                last_mtime = None
+            except Exception as ex:
+                _logger.warning('Log control file {} is not applied: {}'.format(path, ex))
+            stop_event.wait(interval)
+
+    threading.Thread(target=watcher, daemon=True).start()
+    return stop_event
+
+
+def stop_watching(path: str = None) -> None:
+    """stop the watcher of the control file (all watchers by default) and forget the file"""
+    for watched in [path] if path is not None else list(_control_files):
+        stop_event = _control_files.pop(watched, None)
+        if stop_event is not None:
+            stop_event.set()
+
+
+def toggle_debug() -> bool:
+    """Switch the local sinks of all pytils loggers to DEBUG or back to their levels. True if DEBUG is on now.
+    Discord and Telegram keep their levels: they send a request for every record."""
+    global _debug_mode
+    _debug_mode = not _debug_mode
+    if _debug_mode:
+        for sink in LOCAL_SINKS:
+            set_level(sink, 'DEBUG')
+    else:
+        restore_levels()
+    return _debug_mode
+
+
+def install_signal_handlers(toggle_signal=getattr(signal, 'SIGUSR1', None),
+                            reload_signal=getattr(signal, 'SIGUSR2', None)) -> None:
+    """toggle_signal switches DEBUG on and off, reload_signal rereads the control files. Main thread only."""
+    if toggle_signal is not None:
+        signal.signal(toggle_signal, lambda signum, frame: toggle_debug())
+    if reload_signal is not None:
+        def reload(signum, frame):
+            for path in list(_control_files):
+                try:
+                    load_file(path)
+                except Exception as ex:
+                    _logger.warning('Log control file {} is not applied: {}'.format(path, ex))
+        signal.signal(reload_signal, reload)
+
+
+def configure_from_settings() -> None:
+    """Start the file watcher and the signal handlers, if they are switched on in the settings."""
+    control_file = config_var_with_default("LOG_CONTROL_FILE", None)
+    if control_file is not None:
+        watch_file(control_file, interval=config_var_with_default("LOG_CONTROL_INTERVAL", 5))
+    if config_var_with_default("LOG_CONTROL_SIGNALS", False) and threading.current_thread() is threading.main_thread():
+        install_signal_handlers()
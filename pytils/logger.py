@@ -1,11 +1,11 @@
 import logging
-from logging.handlers import TimedRotatingFileHandler
-from functools import wraps
+from functools import wraps, lru_cache
 
 import requests
 import os
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from pytils.configurator import config_var_with_default
+from pytils import profiler
 
 # totally reject the SSL check. Important information have to be logged without this module.
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -76,21 +76,42 @@ def create_logger(name=__name__, logger=None,
         logger = logging.getLogger(name)
         logger.propagate = False
 
-    logs_format = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    # all handlers render the record from its structured form, so it is formatted only once
+    from pytils.structured import StructuredFormatter, JsonFormatter, MessageFormatter
+    logs_format = StructuredFormatter("%(asctime)s - %(levelname)s - %(message)s")
 
-    # Create FileHandler
-    logfile_level = config_var_with_default("LOG_LEVEL_FILE", 'ERROR')
-    if logfile_level is not None:
+    def file_handler(filename):
         logfile_path = config_var_with_default("LOG_FOLDER", './Assets/logs/')
-        import os
         if not os.path.exists(logfile_path):
             os.makedirs(logfile_path)
-        logfile_handler = TimedRotatingFileHandler(logfile_path + 'log', when='D', backupCount=14)
+        from pytils.handler_file import SharedFileHandler
+        return SharedFileHandler(logfile_path + filename, when='D',
+                                 backup_count=config_var_with_default("LOG_FILE_BACKUP_COUNT", 14),
+                                 buffer_size=config_var_with_default("LOG_FILE_BUFFER_KB", 64) * 1024,
+                                 flush_level=config_var_with_default("LOG_FILE_FLUSH_LEVEL", 'ERROR'),
+                                 flush_interval=config_var_with_default("LOG_FILE_FLUSH_INTERVAL", 1),
+                                 compression=config_var_with_default("LOG_FILE_COMPRESSION", 'gzip'))
+
+    # Create FileHandler
+    logfile_level = config_var_with_default("LOG_LEVEL_FILE", 'ERROR')
+    if logfile_level is not None:
+        logfile_handler = file_handler('log')
+        logfile_handler.set_name('file')
         logfile_handler.setLevel(logfile_level)
         logfile_handler.setFormatter(logs_format)
 
         logger.addHandler(logfile_handler)
 
+    # JSON lines file for the log shippers
+    jsonfile_level = config_var_with_default("LOG_LEVEL_JSON", None)
+    if jsonfile_level is not None:
+        jsonfile_handler = file_handler('log.jsonl')
+        jsonfile_handler.set_name('json')
+        jsonfile_handler.setLevel(jsonfile_level)
+        jsonfile_handler.setFormatter(JsonFormatter())
+
+        logger.addHandler(jsonfile_handler)
+
     # Create DiscordHandlerand StreamHandler
     discord_channel = discord_webhook
     discord_level = config_var_with_default("LOG_LEVEL_DISCORD", None)
@@ -98,6 +119,7 @@ def create_logger(name=__name__, logger=None,
         from pytils.handler_discord import DiscordHandler, DiscordFormatter
 
         discord_handler = DiscordHandler(discord_channel)
+        discord_handler.set_name('discord')
         discord_handler.setLevel(discord_level)
         discord_handler.setFormatter(DiscordFormatter())
 
@@ -109,8 +131,9 @@ def create_logger(name=__name__, logger=None,
         from pytils.handler_telegram import TelegramLoggingHandler
         telegram_handler = TelegramLoggingHandler(bot_token=telegram_token, channel=telegram_channel,
                                                   message_thread_id=telegram_thread)
+        telegram_handler.set_name('telegram')
         telegram_handler.setLevel(telegram_level)
-        telegram_format = logging.Formatter("%(levelname)s %(message)s")
+        telegram_format = StructuredFormatter("%(levelname)s %(message)s")
         telegram_handler.setFormatter(telegram_format)
 
         logger.addHandler(telegram_handler)
@@ -118,36 +141,20 @@ def create_logger(name=__name__, logger=None,
     # otlp
     otlp_level = config_var_with_default("LOG_LEVEL_OTLP", 'ERROR')
     if otlp_level is not None:
-        from opentelemetry.sdk.resources import Resource
-        from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
-        from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
-        # from opentelemetry.exporter.otlp.proto.grpc._log_exporter import OTLPLogExporter
-        from opentelemetry.exporter.otlp.proto.http._log_exporter import OTLPLogExporter
-
-        resource_attrs = {"deployment.environment": os.environ.get("APP_ENV", "dev"),
-                           "service.name": appname,
-                           "service.namespace": os.environ.get("SERVICE_NAMESPACE",
-                                                               config_var_with_default("SERVICE_NAMESPACE","pyappspace")),
-                        }
-        if "CONTAINER_NAME" in os.environ:
-            resource_attrs["container.name"] = os.environ.get("CONTAINER_NAME")
-        else:
-            import socket
-            resource_attrs["container.name"] = socket.gethostname()
-
-        resource = Resource(attributes=resource_attrs)
-
-        provider = LoggerProvider(resource=resource)
-        exporter = OTLPLogExporter(endpoint=otlp_endpoint)  # insecure=insecure
-        processor = BatchLogRecordProcessor(exporter)
-        provider.add_log_record_processor(processor)
+        from opentelemetry.sdk._logs import LoggingHandler
+        from pytils.handler_otlp import otlp_provider
+
+        # all loggers share one provider and one export thread for the endpoint
         otlp_handler = LoggingHandler(level=otlp_level,
-                                      logger_provider=provider)
+                                      logger_provider=otlp_provider(otlp_endpoint))
+        otlp_handler.set_name('otlp')
+        otlp_handler.setFormatter(MessageFormatter())
 
         logger.addHandler(otlp_handler)
 
     # Stdout
     stream_level = config_var_with_default("LOG_LEVEL_STREAM", 'DEBUG')
+    handlers_before = list(logger.handlers)
     if stream_level is not None:
         # stream_handler = logging.StreamHandler()
         # stream_handler.setLevel(stream_level)
@@ -165,16 +172,61 @@ def create_logger(name=__name__, logger=None,
                                           'error': {'color': 'red'},
                                           'critical': {'bold': True, 'color': 'red'}})
 
+    # name the sinks and give them to the runtime control of levels and sampling
+    from pytils import log_control
+    for handler in logger.handlers:
+        if handler.name is None and handler not in handlers_before:
+            handler.set_name('stream')
+    log_control.register(logger)
+
     logger.debug(f'Logger {name} set up')
     return logger
 
 
-def log(level=None, arg_included=True):
+@lru_cache(maxsize=None)
+def profile_settings() -> dict:
+    """settings of the timing, read once"""
+    return {'interval': config_var_with_default("LOG_PROFILE_INTERVAL", 60),
+            'level': logging._checkLevel(config_var_with_default("LOG_PROFILE_LEVEL", 'NOTICE')),
+            'top': config_var_with_default("LOG_PROFILE_TOP", 5),
+            'args_length': config_var_with_default("LOG_PROFILE_ARGS_LENGTH", 200)}
+
+
+def start_profiler():
+    """Start the reporter of the timing stats to the logger. Only the first call starts it."""
+    settings = profile_settings()
+    return profiler.start_reporter(logger, interval=settings['interval'], level=settings['level'],
+                                   top=settings['top'])
+
+
+def timed(name: str):
+    """Context manager, which records the wall and CPU time of the block.
+    Percentiles are reported to the logger periodically, like for @log(timing=True).
+
+        with timed('load_prices'):
+            load_prices()
+    """
+    start_profiler()
+    settings = profile_settings()
+    return profiler.timed(name, top=settings['top'], args_length=settings['args_length'])
+
+
+def log(level=None, arg_included=True, timing=False):
     """Decorator for functions, which will log the function request.
     Have to be used with @log(level='YOUR LEVEL') before any function.
+    With timing=True the wall and CPU time of the calls is recorded and reported to the logger periodically
+    (p50/p95/p99, calls, errors and the slowest calls with their arguments).
     """
 
     def log_without_level(func):
+        name = '{}.{}'.format(func.__module__, func.__qualname__)
+        # records of the wrapper come from one line, the sampler tells the functions apart by call_site
+        site = {'call_site': name}
+        if timing:
+            start_profiler()
+            top = profile_settings()['top']
+            args_length = profile_settings()['args_length']
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             try:
@@ -182,24 +234,28 @@ def log(level=None, arg_included=True):
                     msg = "{0}: {1}, {2}".format(func.__name__, str(args), str(kwargs))
                 else:
                     msg = func.__name__
-                logger.debug(f"Processing {msg}", extra={'argi': args, 'kwargi': kwargs})
-                res = func(*args, **kwargs)
+                logger.debug(f"Processing {msg}", extra={'argi': args, 'kwargi': kwargs, **site})
+                if timing:
+                    with profiler.timed(name, args, kwargs, top, args_length):
+                        res = func(*args, **kwargs)
+                else:
+                    res = func(*args, **kwargs)
                 if level is None:
-                    logger.success(msg)
+                    logger.success(msg, extra=site)
                 elif level == 'DEBUG':
-                    logger.debug(msg)
+                    logger.debug(msg, extra=site)
                 elif level == 'INFO':
-                    logger.info(msg)
+                    logger.info(msg, extra=site)
                 elif level == 'WARNING':
-                    logger.warning(msg)
+                    logger.warning(msg, extra=site)
                 elif level == 'ERROR':
-                    logger.error(msg)
+                    logger.error(msg, extra=site)
                 elif isinstance(level, int):
-                    logger.log(msg=msg, level=level)
+                    logger.log(msg=msg, level=level, extra=site)
                 else:
                     raise AttributeError('Error for @log decorator arguments')
             except Exception as ex:
-                logger.exception("{0}: {1}, {2} \n {3}".format(func.__name__, str(args), str(kwargs), ex))
+                logger.exception("{0}: {1}, {2} \n {3}".format(func.__name__, str(args), str(kwargs), ex), extra=site)
                 raise ex
             return res
 
@@ -215,5 +271,9 @@ add_logging_level('NOTICE', 25, methodName=None)
 # create one logger for reserve goals. Just import module with "from pytils.logger import logger" and use in your programm
 create_logger(appname)
 logger = logging.getLogger(appname)
+
+# runtime control of the levels by the watched file and signals, if it is switched on in settings
+from pytils.log_control import configure_from_settings
+configure_from_settings()
 # root_logger = create_logger(logger=logging.getLogger())
 
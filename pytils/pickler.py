@@ -5,7 +5,8 @@ import glob
 import os
 import dill
 import datetime
-from functools import wraps
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import wraps, partial
 from pytils.configurator import *
 from pytils.logger import logger
 
@@ -13,6 +14,19 @@ from pytils.logger import logger
 period_pickle = config_var_with_default('PICKLE_PERIOD_DEFAULT', 1)
 
 
+def _call_dumped(func, args, kwargs) -> bytes:
+    """call the function and return the dill dump of the result, ready to be written to the pickle file"""
+    return dill.dumps(func(*args, **kwargs))
+
+
+def _call_pickled(func_dump: bytes, call_dump: bytes) -> bytes:
+    """the same as _call_dumped, but for the process pool: function and arguments come as dill dumps,
+    because the plain pickle can't find the undecorated function by its name"""
+    func = dill.loads(func_dump)
+    args, kwargs = dill.loads(call_dump)
+    return _call_dumped(func, args, kwargs)
+
+
 def pickledays(period=period_pickle):
     def picklecache(func):
         # Path of storage the pickle files.
@@ -60,6 +74,96 @@ def pickledays(period=period_pickle):
                 except FileNotFoundError:
                     pass
 
+        def age(cachename) -> datetime.timedelta:
+            """how long ago the cache file was written. OSError if there is no file"""
+            return datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(cachename))
+
+        def is_fresh(cachename) -> bool:
+            """is there a cache file, which can be used instead of the function call"""
+            try:
+                return period is not None and age(cachename).days <= period
+            except OSError:
+                return False
+
+        def read(cachename):
+            with open(cachename, "rb") as f:
+                return dill.load(f)
+
+        def store(cachename, future) -> None:
+            """write the dumped result of the finished computation to the cache file"""
+            if future.cancelled() or future.exception() is not None:
+                return
+            with open(cachename, 'wb') as f:
+                f.write(future.result())
+
+        def read_or_call(cachename, args, kwargs):
+            """read the fresh cache file. If it is broken, call the function in place like the wrapper does"""
+            try:
+                return read(cachename)
+            except Exception:
+                result = func(*args, **kwargs)
+                dill.dump(result, open(cachename, 'wb'))
+                return result
+
+        def imap(iterable, max_workers=None, executor='process'):
+            """Generator over the results of the function for every item of the iterable, in the input order.
+
+            Item of the iterable is a tuple of positional args, a dict of keyword args or a single argument.
+            All cache files are checked up front: fresh ones are read in the threads,
+            missed ones are computed in the process pool (executor='process')
+            or in the thread pool (executor='thread', for I/O-bound functions) and written back.
+            """
+            if executor == 'process':
+                pool_class = ProcessPoolExecutor
+            elif executor == 'thread':
+                pool_class = ThreadPoolExecutor
+            else:
+                raise ValueError("executor has to be 'process' or 'thread', not {}".format(executor))
+
+            calls = []
+            for item in iterable:
+                if isinstance(item, tuple):
+                    calls.append((item, {}))
+                elif isinstance(item, dict):
+                    calls.append(((), item))
+                else:
+                    calls.append(((item,), {}))
+            cachenames = [makename(args, kwargs) for args, kwargs in calls]
+
+            # the same arguments are resolved only once
+            unique = {}
+            for cachename, call in zip(cachenames, calls):
+                unique.setdefault(cachename, call)
+            hits = {cachename for cachename in unique if is_fresh(cachename)}
+            logger.debug('{} map: {} calls, {} cached, {} to compute'.format(
+                func.__name__, len(calls), len(hits), len(unique) - len(hits)))
+
+            if len(hits) < len(unique) and not os.path.exists(path_pickle):
+                os.makedirs(path_pickle)
+
+            with ThreadPoolExecutor(max_workers) as io_pool, pool_class(max_workers) as compute_pool:
+                if executor == 'process':
+                    func_dump = dill.dumps(func, recurse=True)
+                futures = {}
+                for cachename, (args, kwargs) in unique.items():
+                    if cachename in hits:
+                        futures[cachename] = io_pool.submit(read_or_call, cachename, args, kwargs)
+                        continue
+                    if executor == 'process':
+                        future = compute_pool.submit(_call_pickled, func_dump, dill.dumps((args, kwargs)))
+                    else:
+                        future = compute_pool.submit(_call_dumped, func, args, kwargs)
+                    future.add_done_callback(partial(store, cachename))
+                    futures[cachename] = future
+
+                for cachename in cachenames:
+                    result = futures[cachename].result()
+                    yield result if cachename in hits else dill.loads(result)
+
+        def map(iterable, max_workers=None, executor='process') -> list:
+            """list of the results of the function for every item of the iterable. See imap."""
+            return list(imap(iterable, max_workers=max_workers, executor=executor))
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             """wrapper which does the actual caching"""
@@ -75,29 +179,25 @@ def pickledays(period=period_pickle):
                 dill.dump(result, open(cachename, 'wb'))
                 return result
 
-            def read():
-                with open(cachename, "rb") as f:
-                    result = dill.load(f)
-                return result
-
             try:
-                import datetime
-                ftime = (datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(cachename)))
+                ftime = age(cachename)
                 if ftime.days > period or period is None:
                     logger.info('{} smell during {} > {}. Try to reload.'.format(func.__name__, ftime, period))
                     raise FileExistsError
                 else:
                     logger.debug('{} fresh {}'.format(func.__name__, ftime))
-                    result = read()
+                    result = read(cachename)
             except:
                 # if file not founded and read unsuccessful
                 result = write()
                 logger.debug('{} refreshed'.format(func.__name__))
             return result
 
-        # attach clearcache and clearallcache to wrapper
+        # attach clearcache, clearallcache and batch calls to wrapper
         wrapper.clearcache = clearcache
         wrapper.clearallcache = clearallcache
+        wrapper.map = map
+        wrapper.imap = imap
 
         return wrapper
 
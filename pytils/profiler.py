@@ -0,0 +1,256 @@
+"""Timing of the hot functions: wall and CPU time histograms, call and error counts, the slowest calls.
+
+Every thread writes to its own stats without locks. The reporter merges them and sends
+the percentiles for the last interval to the logger. Use it through @log(timing=True) or `with timed(name):`.
+"""
+import atexit
+import bisect
+import heapq
+import itertools
+import logging
+import multiprocessing.util
+import os
+import threading
+import time
+import weakref
+
+# upper bounds of the histogram buckets in seconds: 1 us .. 1000 s, 16 buckets for each 10 times
+BOUNDS = [10 ** (e / 16) for e in range(-6 * 16, 3 * 16 + 1)]
+
+_local = threading.local()
+# holder id -> (name -> stats) of the live threads. The reporter reads them, the threads only add names
+_threads = {}
+# stats of the finished threads, folded together
+_retired = {}
+# keys of the finished threads, which are not folded yet
+_finished = []
+_keys = itertools.count()
+_register_lock = threading.Lock()
+_reporter = None
+
+
+class _ThreadStats:
+    """Holder of the thread stats in the thread local storage. It dies with the thread."""
+    __slots__ = ('stats', '__weakref__')
+
+    def __init__(self):
+        self.stats = {}
+
+
+class FunctionStats:
+    """Stats of one function in one thread."""
+    __slots__ = ('calls', 'errors', 'wall', 'cpu', 'slowest')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wall = [0] * (len(BOUNDS) + 1)
+        self.cpu = [0] * (len(BOUNDS) + 1)
+        # heap of (wall time, arguments) of the slowest calls
+        self.slowest = []
+
+    def merge(self, other: 'FunctionStats') -> None:
+        """add the stats of the other thread, keep the same number of the slowest calls"""
+        self.calls += other.calls
+        self.errors += other.errors
+        self.wall = [a + b for a, b in zip(self.wall, other.wall)]
+        self.cpu = [a + b for a, b in zip(self.cpu, other.cpu)]
+        top = max(len(self.slowest), len(other.slowest))
+        self.slowest = heapq.nlargest(top, self.slowest + list(other.slowest))
+        heapq.heapify(self.slowest)
+
+    def add(self, wall: float, cpu: float, error: bool, args=None, kwargs=None, top: int = 5, args_length: int = 200):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.wall[bisect.bisect_left(BOUNDS, wall)] += 1
+        self.cpu[bisect.bisect_left(BOUNDS, cpu)] += 1
+        # the arguments are converted to string only for the slowest calls
+        if len(self.slowest) < top:
+            heapq.heappush(self.slowest, (wall, '{}, {}'.format(args, kwargs)[:args_length]))
+        elif wall > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (wall, '{}, {}'.format(args, kwargs)[:args_length]))
+
+
+def stats(name: str) -> FunctionStats:
+    """stats of the function in the current thread"""
+    try:
+        return _local.holder.stats[name]
+    except AttributeError:
+        _local.holder = _ThreadStats()
+        key = next(_keys)
+        with _register_lock:
+            _threads[key] = _local.holder.stats
+        # the stats of the finished thread are folded to _retired, so _threads doesn't grow with the threads
+        weakref.finalize(_local.holder, _finished.append, key)
+    except KeyError:
+        pass
+    result = _local.holder.stats[name] = FunctionStats()
+    return result
+
+
+def _fold_finished() -> None:
+    """move the stats of the finished threads to _retired. Called under _register_lock.
+    Not done by the finalizer itself: it may run in the thread, which holds the lock."""
+    while _finished:
+        for name, item in _threads.pop(_finished.pop(), {}).items():
+            _retired.setdefault(name, FunctionStats()).merge(item)
+
+
+class timed:
+    """Context manager, which records the wall and CPU time of the block.
+
+        with timed('load_prices'):
+            load_prices()
+    """
+    __slots__ = ('name', 'args', 'kwargs', 'top', 'args_length', '_wall', '_cpu')
+
+    def __init__(self, name: str, args=None, kwargs=None, top: int = 5, args_length: int = 200):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.top = top
+        self.args_length = args_length
+
+    def __enter__(self):
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        stats(self.name).add(wall, cpu, exc_type is not None, self.args, self.kwargs, self.top, self.args_length)
+        return False
+
+
+def snapshot() -> dict:
+    """name -> merged stats of all threads, the finished ones too"""
+    merged = {}
+    with _register_lock:
+        _fold_finished()
+        items = [(name, item) for name, item in _retired.items()]
+        for thread_stats in _threads.values():
+            items.extend(list(thread_stats.items()))
+        for name, item in items:
+            merged.setdefault(name, FunctionStats()).merge(item)
+    for total in merged.values():
+        total.slowest.sort(reverse=True)
+    return merged
+
+
+def percentile(histogram: list, q: float) -> float:
+    """upper bound of the bucket with the q-th part of the calls, seconds"""
+    count = sum(histogram)
+    if not count:
+        return 0.
+    rank = q * count
+    cumulative = 0
+    for i, n in enumerate(histogram):
+        cumulative += n
+        if cumulative >= rank:
+            return BOUNDS[min(i, len(BOUNDS) - 1)]
+    return BOUNDS[-1]
+
+
+def summary(current: dict, previous: dict = None, top: int = 5) -> dict:
+    """name -> percentiles (ms), calls and errors between two snapshots and the slowest calls since the start"""
+    previous = previous or {}
+    result = {}
+    for name, item in current.items():
+        before = previous.get(name, FunctionStats())
+        calls = item.calls - before.calls
+        if not calls:
+            continue
+        wall = [a - b for a, b in zip(item.wall, before.wall)]
+        cpu = [a - b for a, b in zip(item.cpu, before.cpu)]
+        result[name] = {'calls': calls,
+                        'errors': item.errors - before.errors,
+                        'wall_p50_ms': percentile(wall, 0.5) * 1000,
+                        'wall_p95_ms': percentile(wall, 0.95) * 1000,
+                        'wall_p99_ms': percentile(wall, 0.99) * 1000,
+                        'cpu_p50_ms': percentile(cpu, 0.5) * 1000,
+                        'cpu_p95_ms': percentile(cpu, 0.95) * 1000,
+                        'cpu_p99_ms': percentile(cpu, 0.99) * 1000,
+                        'slowest': ['{:.3g} ms {}'.format(wall * 1000, args) for wall, args in item.slowest[:top]],
+                        }
+    return result
+
+
+class Reporter:
+    """Sends the summary of the last interval to the logger every interval seconds and at the exit."""
+
+    def __init__(self, logger: logging.Logger, interval: float = 60, level=logging.INFO, top: int = 5):
+        self.logger = logger
+        self.interval = interval
+        self.level = level
+        self.top = top
+        self._start()
+        atexit.register(self.report)
+
+    def _start(self):
+        """lock and thread of this process. Called again in the forked child"""
+        self._previous = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._report_manager, daemon=True)
+        self._thread.start()
+
+    def report(self) -> None:
+        with self._lock:
+            current = snapshot()
+            result = summary(current, self._previous, self.top)
+            self._previous = current
+        for name, item in result.items():
+            # significant digits: microseconds are not rounded to zero
+            msg = ('profile {}: {} calls, {} errors, wall p50/p95/p99 {:.3g}/{:.3g}/{:.3g} ms, '
+                   'cpu p50/p95/p99 {:.3g}/{:.3g}/{:.3g} ms').format(
+                name, item['calls'], item['errors'],
+                item['wall_p50_ms'], item['wall_p95_ms'], item['wall_p99_ms'],
+                item['cpu_p50_ms'], item['cpu_p95_ms'], item['cpu_p99_ms'])
+            if item['slowest']:
+                msg += ', slowest {}'.format(item['slowest'][0])
+            self.logger.log(self.level, msg, extra={'profile_' + k: v for k, v in item.items()})
+
+    def _report_manager(self):
+        while True:
+            time.sleep(self.interval)
+            self.report()
+
+
+def start_reporter(logger: logging.Logger, interval: float = 60, level=logging.INFO, top: int = 5) -> Reporter:
+    """the one reporter for the process. The first call starts it, next ones return it"""
+    global _reporter
+    if _reporter is None:
+        with _register_lock:
+            if _reporter is None:
+                _reporter = Reporter(logger, interval=interval, level=level, top=top)
+    return _reporter
+
+
+def _reset_after_fork():
+    """The child starts with empty stats: the parent reports its own calls.
+    The locks may be taken by the threads of the parent, which are not copied, the reporter thread is dead."""
+    global _local, _register_lock
+    _local = threading.local()
+    _register_lock = threading.Lock()
+    _threads.clear()
+    _retired.clear()
+    _finished.clear()
+    if _reporter is not None:
+        _reporter._start()
+
+
+def _report():
+    if _reporter is not None:
+        _reporter.report()
+
+
+def _report_at_worker_exit(func):
+    """multiprocessing workers exit by os._exit without atexit. Reported before the file handlers are flushed"""
+    multiprocessing.util.Finalize(None, func, exitpriority=20)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+# called in every multiprocessing child after its finalizers are cleared
+multiprocessing.util.register_after_fork(_report, _report_at_worker_exit)
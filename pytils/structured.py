@@ -0,0 +1,122 @@
+"""Structured form of the log record, shared by all handlers.
+
+The record is converted to the dict and to JSON only once, whatever number of handlers it passes through.
+Static fields (service and host) are computed once for the process.
+"""
+import datetime
+import json
+import logging
+import os
+import socket
+import weakref
+from functools import lru_cache
+
+from pytils.configurator import config_var_with_default
+
+try:
+    import orjson
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, default=str).decode('utf-8')
+except ImportError:
+    def dumps(obj) -> str:
+        return json.dumps(obj, default=str, separators=(',', ':'), ensure_ascii=False)
+
+# record -> its structured form. Weak keys: nothing is kept after the record is handled.
+# Not an attribute of the record, otherwise OTLP would export it as the attribute.
+_fields_cache = weakref.WeakKeyDictionary()
+_json_cache = weakref.WeakKeyDictionary()
+_default_formatter = logging.Formatter()
+
+
+@lru_cache(maxsize=None)
+def static_fields() -> dict:
+    """Fields of the service and the host, where it works. The same for all records. Used as the OTLP resource."""
+    fields = {"deployment.environment": os.environ.get("APP_ENV", "dev"),
+              "service.name": config_var_with_default("SERVICE_NAME", "pyapp"),
+              "service.namespace": os.environ.get("SERVICE_NAMESPACE",
+                                                  config_var_with_default("SERVICE_NAMESPACE", "pyappspace")),
+              }
+    if "CONTAINER_NAME" in os.environ:
+        fields["container.name"] = os.environ.get("CONTAINER_NAME")
+    else:
+        fields["container.name"] = socket.gethostname()
+    return fields
+
+
+@lru_cache(maxsize=None)
+def _static_json() -> str:
+    """static fields as the JSON object without braces, ready to be glued to the record"""
+    return dumps(static_fields())[1:-1]
+
+
+def structured(record: logging.LogRecord) -> dict:
+    """Record fields, which are different for every record. Computed once per record."""
+    try:
+        return _fields_cache[record]
+    except KeyError:
+        pass
+    fields = {"time": datetime.datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+              "level": record.levelname,
+              "logger": record.name,
+              "message": record.getMessage(),
+              "module": record.module,
+              "function": record.funcName,
+              "line": record.lineno,
+              "process": record.process,
+              "thread": record.threadName,
+              }
+    if hasattr(record, "sampled_out"):
+        # records of the same place dropped by the sampler before this one
+        fields["sampled_out"] = record.sampled_out
+    if record.exc_info and not record.exc_text:
+        # cached on the record the same way logging.Formatter does, so all handlers reuse it
+        record.exc_text = _default_formatter.formatException(record.exc_info)
+    if record.exc_text:
+        fields["exception"] = record.exc_text
+    _fields_cache[record] = fields
+    return fields
+
+
+def to_json(record: logging.LogRecord) -> str:
+    """one line JSON of the record with the static fields. Computed once per record."""
+    try:
+        return _json_cache[record]
+    except KeyError:
+        pass
+    result = dumps(structured(record))
+    if _static_json():
+        result = result[:-1] + ',' + _static_json() + '}'
+    _json_cache[record] = result
+    return result
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON lines for the log shippers."""
+
+    def format(self, record) -> str:
+        return to_json(record)
+
+
+class StructuredFormatter(logging.Formatter):
+    """logging.Formatter, which takes the message and the exception from the structured form of the record,
+    instead of the formatting them again for every handler."""
+
+    def format(self, record) -> str:
+        fields = structured(record)
+        record.message = fields["message"]
+        if self.usesTime():
+            record.asctime = self.formatTime(record, self.datefmt)
+        s = self.formatMessage(record)
+        if "exception" in fields:
+            s = s + '\n' + fields["exception"]
+        if record.stack_info:
+            s = s + '\n' + self.formatStack(record.stack_info)
+        return s
+
+
+class MessageFormatter(logging.Formatter):
+    """Just the message of the structured form. For the handlers, which send the other fields on their own (OTLP)."""
+
+    def format(self, record) -> str:
+        return structured(record)["message"]
@@ -0,0 +1,86 @@
+import gzip
+import logging
+import multiprocessing
+import os
+import time
+import weakref
+
+from pytils.handler_file import SharedFileHandler
+
+
+def make_logger(name, path, **kwargs):
+    handler = SharedFileHandler(str(path), flush_interval=60, **kwargs)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    lg = logging.getLogger(name)
+    lg.propagate = False
+    lg.setLevel(logging.DEBUG)
+    lg.handlers = [handler]
+    return lg, handler
+
+
+def test_buffer_and_flush_level(tmp_path):
+    lg, handler = make_logger('test_buffer_and_flush_level', tmp_path / 'log')
+    lg.info('buffered')
+    assert not (tmp_path / 'log').exists()
+    lg.error('flushed')
+    assert (tmp_path / 'log').read_text() == 'INFO buffered\nERROR flushed\n'
+    handler.close()
+
+
+def test_rotation_compressed(tmp_path):
+    path = tmp_path / 'log'
+    path.write_text('yesterday\n')
+    day_ago = time.time() - 24 * 3600
+    os.utime(path, (day_ago, day_ago))
+
+    lg, handler = make_logger('test_rotation_compressed', path)
+    lg.error('today')
+    handler.close()
+    assert path.read_text() == 'ERROR today\n'
+    [rotated] = tmp_path.glob('log.*.gz')
+    assert gzip.decompress(rotated.read_bytes()) == b'yesterday\n'
+
+
+def write_many(path, n, close=True):
+    lg, handler = make_logger('write_many', path, buffer_size=256)
+    for e in range(n):
+        lg.info('{} {}'.format(os.getpid(), e))
+    if close:
+        handler.close()
+
+
+def test_several_processes(tmp_path):
+    path = tmp_path / 'log'
+    # the last worker exits without close(): its buffer is flushed at the exit of the process
+    workers = [multiprocessing.Process(target=write_many, args=(path, 500, w < 3)) for w in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2000
+    assert all(line.startswith('INFO ') for line in lines)
+
+
+def test_forked_worker_flushes(tmp_path):
+    path = tmp_path / 'log'
+    lg, handler = make_logger('test_forked_worker_flushes', path)
+    worker = multiprocessing.get_context('fork').Process(target=lambda: [lg.info('child') for _ in range(10)])
+    worker.start()
+    worker.join()
+    lg.error('parent')
+    handler.close()
+    assert path.read_text().splitlines() == ['INFO child'] * 10 + ['ERROR parent']
+
+
+def test_closed_handler_released(tmp_path):
+    import gc
+    from pytils import handler_file
+    lg, handler = make_logger('test_closed_handler_released', tmp_path / 'log')
+    handler.close()
+    lg.handlers = []
+    assert handler not in handler_file._open_handlers
+    ref = weakref.ref(handler)
+    del handler
+    gc.collect()
+    assert ref() is None
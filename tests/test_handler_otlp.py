@@ -0,0 +1,156 @@
+import logging
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from opentelemetry.proto.collector.logs.v1.logs_service_pb2 import ExportLogsServiceRequest
+from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
+from opentelemetry.sdk._logs.export import SimpleLogRecordProcessor
+
+from pytils.handler_otlp import DiskSpool, SpoolingLogExporter, otlp_provider
+
+
+class StubCollector(BaseHTTPRequestHandler):
+    """Collects the bodies of the log records, which were posted to it."""
+    received = []
+
+    def do_POST(self):
+        request = ExportLogsServiceRequest()
+        request.ParseFromString(self.rfile.read(int(self.headers['Content-Length'])))
+        for resource_logs in request.resource_logs:
+            for scope_logs in resource_logs.scope_logs:
+                self.received.extend(r.body.string_value for r in scope_logs.log_records)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class AuthCollector(StubCollector):
+    """Accepts only the requests with the authorization header."""
+    received = []
+
+    def do_POST(self):
+        if self.headers.get('authorization') != 'secret':
+            self.send_response(401)
+            self.end_headers()
+            return
+        super().do_POST()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_spool_and_replay(tmp_path):
+    port = free_port()
+    exporter = SpoolingLogExporter('http://127.0.0.1:{}/v1/logs'.format(port),
+                                   spool_folder=str(tmp_path), spool_max_bytes=2 ** 20, timeout=1, backoff=0.3)
+    provider = LoggerProvider()
+    provider.add_log_record_processor(SimpleLogRecordProcessor(exporter))
+    lg = logging.getLogger('test_spool_and_replay')
+    lg.propagate = False
+    lg.addHandler(LoggingHandler(logger_provider=provider))
+
+    # collector is down: batches go to the disk
+    lg.error('first')
+    lg.error('second')
+    assert len(list(tmp_path.glob('*.pb'))) == 2
+
+    server = HTTPServer(('127.0.0.1', port), StubCollector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # during the backoff batches go straight to the disk without the network
+        lg.error('third')
+        assert StubCollector.received == []
+        time.sleep(0.35)
+        lg.error('fourth')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert StubCollector.received == ['first', 'second', 'third', 'fourth']
+    assert list(tmp_path.glob('*.pb')) == []
+
+
+def test_spool_shared_by_processes(tmp_path):
+    first = DiskSpool(str(tmp_path), max_bytes=10)
+    second = DiskSpool(str(tmp_path), max_bytes=10)
+    first.push(b'0123456789')
+    # the limit is checked for the whole folder, not for the segments of one spool
+    second.push(b'abcdef')
+    assert [p.read_bytes() for p in sorted(tmp_path.glob('*.pb'))] == [b'abcdef']
+    with first.replaying() as acquired:
+        assert acquired
+        with second.replaying() as acquired_too:
+            assert not acquired_too
+
+
+def test_spool_is_bounded(tmp_path):
+    exporter = SpoolingLogExporter('http://127.0.0.1:{}/v1/logs'.format(free_port()),
+                                   spool_folder=str(tmp_path), spool_max_bytes=10, timeout=1)
+    exporter._spool.push(b'0123456789')
+    exporter._spool.push(b'abcdef')
+    assert [p.read_bytes() for p in sorted(tmp_path.glob('*.pb'))] == [b'abcdef']
+
+
+def test_provider_shared():
+    assert otlp_provider('http://127.0.0.1:1/v1/logs') is otlp_provider('http://127.0.0.1:1/v1/logs')
+
+
+def test_replay_uses_exporter_headers(tmp_path, monkeypatch):
+    monkeypatch.setenv('OTEL_EXPORTER_OTLP_LOGS_HEADERS', 'authorization=secret')
+    port = free_port()
+    exporter = SpoolingLogExporter('http://127.0.0.1:{}/v1/logs'.format(port),
+                                   spool_folder=str(tmp_path), spool_max_bytes=2 ** 20, timeout=1, backoff=0)
+    provider = LoggerProvider()
+    provider.add_log_record_processor(SimpleLogRecordProcessor(exporter))
+    lg = logging.getLogger('test_replay_uses_exporter_headers')
+    lg.propagate = False
+    lg.addHandler(LoggingHandler(logger_provider=provider))
+
+    lg.error('during outage')
+    assert len(list(tmp_path.glob('*.pb'))) == 1
+
+    server = HTTPServer(('127.0.0.1', port), AuthCollector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        lg.error('after outage')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert AuthCollector.received == ['during outage', 'after outage']
+    assert list(tmp_path.glob('*.pb')) == []
+
+
+def test_unauthorized_batches_kept(tmp_path):
+    port = free_port()
+    exporter = SpoolingLogExporter('http://127.0.0.1:{}/v1/logs'.format(port),
+                                   spool_folder=str(tmp_path), spool_max_bytes=2 ** 20, timeout=1, backoff=0)
+    exporter._spool.push(b'batch')
+    server = HTTPServer(('127.0.0.1', port), AuthCollector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # no header: 401 is not a reason to delete the batch
+        assert not exporter.replay()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert [p.read_bytes() for p in tmp_path.glob('*.pb')] == [b'batch']
+
+
+def test_lock_released_in_forked_child(tmp_path):
+    import multiprocessing
+    exporter = SpoolingLogExporter('http://127.0.0.1:{}/v1/logs'.format(free_port()),
+                                   spool_folder=str(tmp_path), spool_max_bytes=2 ** 20, timeout=1)
+    # the fork happens during the export in another thread
+    with exporter._lock:
+        worker = multiprocessing.get_context('fork').Process(target=exporter.replay)
+        worker.start()
+    worker.join(timeout=10)
+    if worker.is_alive():
+        worker.terminate()
+    assert worker.exitcode == 0
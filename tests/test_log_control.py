@@ -0,0 +1,99 @@
+import json
+import logging
+import time
+
+import pytest
+
+from pytils import log_control
+from pytils.log_control import Sampler
+from pytils.logger import logger
+
+
+@pytest.fixture
+def restore():
+    yield
+    log_control.stop_watching()
+    log_control.restore_levels()
+    log_control.set_sampling()
+
+
+def make_record(level=logging.DEBUG, lineno=10):
+    return logging.LogRecord('test', level, __file__, lineno, 'msg', (), None)
+
+
+def test_set_level(restore):
+    log_control.set_level('file', 'DEBUG', logger.name)
+    assert log_control.get_levels(logger.name)['file'] == 'DEBUG'
+    assert logger.isEnabledFor(logging.DEBUG)
+    log_control.restore_levels(logger.name)
+    assert log_control.get_levels(logger.name)['file'] == 'ERROR'
+
+
+def test_wrong_sink():
+    with pytest.raises(ValueError):
+        log_control.set_level('printer', 'DEBUG')
+
+
+def test_toggle_debug(restore):
+    assert log_control.toggle_debug()
+    levels = log_control.get_levels(logger.name)
+    assert {levels[sink] for sink in log_control.LOCAL_SINKS if sink in levels} == {'DEBUG'}
+    # chat sinks are not flooded
+    assert all(levels[sink] != 'DEBUG' for sink in ('discord', 'telegram') if sink in levels)
+    assert not log_control.toggle_debug()
+    assert log_control.get_levels(logger.name)['file'] == 'ERROR'
+
+
+def test_watch_file(tmp_path, restore):
+    path = tmp_path / 'log_control.json'
+    path.write_text(json.dumps({'loggers': {logger.name: {'levels': {'otlp': 'WARNING'},
+                                                          'sampling': {'probability': 0.5}}}}))
+    stop_event = log_control.watch_file(str(path), interval=0.05)
+    for _ in range(100):
+        if log_control.get_levels(logger.name)['otlp'] == 'WARNING':
+            break
+        time.sleep(0.01)
+    assert log_control.get_levels(logger.name)['otlp'] == 'WARNING'
+    assert any(isinstance(f, Sampler) for f in logger.filters)
+    log_control.stop_watching(str(path))
+    assert stop_event.is_set()
+    assert str(path) not in log_control._control_files
+
+
+def test_token_bucket():
+    sampler = Sampler(rate=0.001, burst=3)
+    passed = [sampler.filter(make_record()) for _ in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    # other call site has its own bucket, higher levels are not sampled
+    assert sampler.filter(make_record(lineno=11))
+    assert sampler.filter(make_record(level=logging.ERROR))
+    assert sampler.stats() == {'{}:10'.format(__file__): 7}
+
+
+def test_sampled_out_reported():
+    sampler = Sampler(probability=0)
+    assert not sampler.filter(make_record())
+    sampler.probability = 1
+    record = make_record()
+    assert sampler.filter(record)
+    assert record.sampled_out == 1
+
+
+def test_sampling_decorated_functions(restore):
+    from pytils.logger import log
+
+    @log()
+    def first():
+        return 1
+
+    @log()
+    def second():
+        return 2
+
+    # only the DEBUG "Processing" records of the wrappers are sampled, all of them come from one line of logger.py
+    log_control.set_sampling(logger.name, rate=0.0001, burst=1)
+    for _ in range(3):
+        first()
+    second()
+    stats = log_control.sampling_stats(logger.name)[logger.name]
+    assert stats == {first.__module__ + '.' + first.__qualname__: 2}
@@ -64,4 +64,84 @@ def test_highload():
 def test_root_logger():
     lg = logging.getLogger()
     lg.critical("ROOT message")
-    assert True
\ No newline at end of file
+    assert True
+
+@log('DEBUG', timing=True)
+def func_timed(a, fail=False):
+    if fail:
+        raise ValueError('testError')
+    return a
+
+
+def test_log_timing():
+    from pytils import profiler
+    for e in range(10):
+        func_timed(e)
+    try:
+        func_timed(99, fail=True)
+    except ValueError:
+        pass
+    with timed('test_block'):
+        sum(range(1000))
+    result = profiler.summary(profiler.snapshot())
+    stats = result['{}.func_timed'.format(__name__)]
+    assert stats['calls'] == 11
+    assert stats['errors'] == 1
+    assert 0 < stats['wall_p50_ms'] <= stats['wall_p99_ms']
+    assert len(stats['slowest']) == 5
+    assert result['test_block']['calls'] == 1
+    profiler.start_reporter(logger).report()
+
+
+def test_timing_finished_threads():
+    import threading
+    from pytils import profiler
+    name = 'test_thread_block'
+    for _ in range(5):
+        thread = threading.Thread(target=lambda: timed(name).__enter__().__exit__(None, None, None))
+        thread.start()
+        thread.join()
+    result = profiler.summary(profiler.snapshot())
+    assert result[name]['calls'] == 5
+    # the stats of the finished threads are folded, only the live ones are kept separately
+    assert len(profiler._threads) <= threading.active_count()
+
+
+def test_timing_report_microseconds(caplog):
+    from pytils import profiler
+    reporter = profiler.Reporter(logging.getLogger('test_timing_report'), interval=3600, level=logging.INFO)
+    with timed('test_fast_block'):
+        pass
+    with caplog.at_level(logging.INFO, logger='test_timing_report'):
+        reporter.report()
+    [message] = [r.getMessage() for r in caplog.records if 'test_fast_block' in r.getMessage()]
+    assert 'p50/p95/p99 0.00/' not in message
+
+
+def forked_timing(results):
+    from pytils import profiler
+    reporter = profiler.start_reporter(logger)
+    started_empty = not profiler.snapshot()
+    with timed('test_child_block'):
+        pass
+    results.put((started_empty, reporter._thread.is_alive(), sorted(profiler.snapshot())))
+
+
+def test_timing_forked_worker():
+    import multiprocessing
+    from pytils import profiler
+    with timed('test_parent_block'):
+        pass
+    profiler.start_reporter(logger)
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    # the fork happens, while another thread of the parent registers its stats
+    with profiler._register_lock:
+        worker = context.Process(target=forked_timing, args=(results,))
+        worker.start()
+    worker.join(timeout=10)
+    if worker.is_alive():
+        worker.terminate()
+    assert worker.exitcode == 0
+    assert results.get(timeout=1) == (True, True, ['test_child_block'])
+    assert 'test_parent_block' in profiler.snapshot()
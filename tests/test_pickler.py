@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from pytils.pickler import pickledays
+
+
+@pickledays(period=1)
+def square(x, shift=0):
+    return x * x + shift
+
+
+@pytest.mark.parametrize("executor", ['thread', 'process'])
+def test_map(executor):
+    items = [2, (3,), {'x': 4, 'shift': 1}, 2]
+    for item in (2, 3):
+        square.clearcache(item)
+    answer = square.map(items, max_workers=2, executor=executor)
+    assert answer == [4, 9, 17, 4]
+    # computed results are written back and read from the cache next time
+    assert square(3) == 9
+    assert square.map(items, executor=executor) == answer
+
+
+def test_imap_order():
+    answer = square.imap(range(5), executor='thread')
+    assert list(answer) == [0, 1, 4, 9, 16]
+
+
+def test_map_wrong_executor():
+    with pytest.raises(ValueError):
+        square.map([1], executor='gpu')
@@ -0,0 +1,42 @@
+import json
+import logging
+
+from pytils.handler_discord import DiscordFormatter
+from pytils.structured import JsonFormatter, StructuredFormatter, static_fields, structured, to_json
+
+
+def make_record(msg='value %s', args=(42,), exc_info=None):
+    return logging.LogRecord('test', logging.ERROR, __file__, 10, msg, args, exc_info)
+
+
+def test_structured_once():
+    record = make_record()
+    fields = structured(record)
+    assert fields['message'] == 'value 42'
+    assert fields['level'] == 'ERROR'
+    assert structured(record) is fields
+    assert to_json(record) is to_json(record)
+    # nothing is added to the record, OTLP exports its attributes
+    assert 'structured' not in vars(record)
+
+
+def test_json_line():
+    line = JsonFormatter().format(make_record())
+    assert '\n' not in line
+    data = json.loads(line)
+    assert data['message'] == 'value 42'
+    assert data['service.name'] == static_fields()['service.name']
+
+
+def test_formatters_share_message():
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        import sys
+        record = make_record(exc_info=sys.exc_info())
+    text = StructuredFormatter("%(levelname)s %(message)s").format(record)
+    assert text.startswith('ERROR value 42\n')
+    assert 'ValueError: boom' in text
+    embed = json.loads(DiscordFormatter().format(record))['embeds'][0]
+    assert embed['description'] == 'value 42'
+    assert embed['timestamp'] == structured(record)['time']